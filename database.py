@@ -5,11 +5,12 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Iterable, List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -17,16 +18,63 @@ load_dotenv()
 
 _client = None
 db = None
+redis_client = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
+redis_url = os.getenv("REDIS_URL")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Pools are per process and every worker (WEB_CONCURRENCY) opens its own, so
+# DATABASE_MAX_POOL_SIZE is the budget for the whole host and is split across workers.
+# DATABASE_MIN_POOL_SIZE is per worker; idle connections multiply by the worker count.
+_workers = int(os.getenv("WEB_CONCURRENCY", 1))
+max_pool_size = max(1, int(os.getenv("DATABASE_MAX_POOL_SIZE", 100)) // _workers)
+min_pool_size = min(int(os.getenv("DATABASE_MIN_POOL_SIZE", 0)), max_pool_size)
+
+def connect_db():
+    """Create the Motor client; call from a startup hook so it binds to the running loop"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        # One pooled client per process; tz_aware so datetimes read back as UTC-aware,
+        # matching what we store
+        _client = AsyncIOMotorClient(
+            database_url,
+            tz_aware=True,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            serverSelectionTimeoutMS=2000,
+            uuidRepresentation="standard",
+        )
+        db = _client[database_name]
+    return db
+
+def close_db():
+    """Close the Motor client and its connection pool"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
+
+def connect_redis():
+    """Create the Redis client used for auth tokens; optional, like the database"""
+    global redis_client
+    if redis_client is None and redis_url:
+        # Short timeouts so an unreachable Redis degrades to the Mongo fallback quickly
+        redis_client = Redis.from_url(
+            redis_url, decode_responses=True, socket_connect_timeout=1, socket_timeout=1
+        )
+    return redis_client
+
+async def close_redis():
+    """Close the Redis client and its connection pool"""
+    global redis_client
+    if redis_client is not None:
+        await redis_client.aclose()
+    redis_client = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -37,19 +85,59 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def create_documents(collection_name: str, items: Iterable[Union[BaseModel, dict]]) -> List[str]:
+    """Insert many documents with timestamps in a single round-trip"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+    if not docs:
+        return []
+
+    result = await db[collection_name].insert_many(docs, ordered=False)
+    return [str(i) for i in result.inserted_ids]
+
+async def update_document(collection_name: str, filter_dict: dict, data: dict):
+    """Set fields on the first matching document and bump its timestamp"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    update = {**data, 'updated_at': datetime.now(timezone.utc)}
+    result = await db[collection_name].update_one(filter_dict, {'$set': update})
+    return result.modified_count
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None,
+                        projection: dict = None, sort: list = None, skip: int = None):
+    """Get documents from collection, optionally projected, sorted and paginated"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if skip:
+        cursor = cursor.skip(skip)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
+
+def serialize_ids(docs: List[dict]) -> List[dict]:
+    """Build API-ready dicts with a string id in place of the ObjectId _id"""
+    return [
+        {"id": str(doc["_id"]), **{k: v for k, v in doc.items() if k != "_id"}}
+        for doc in docs
+    ]
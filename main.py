@@ -1,85 +1,280 @@
+import asyncio
+import hmac
+import logging
 import os
-from datetime import datetime
+import re
+import secrets
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
 from typing import List, Optional
 
-from fastapi import FastAPI, HTTPException, Depends
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from redis.exceptions import RedisError
+
+import database
+from database import (
+    connect_db, close_db, connect_redis, close_redis, create_document, create_documents, get_documents, serialize_ids,
+    update_document,
+)
+from schemas import Contactmessage, Blogpost, Email, Userauth, Pricingplan
 
-from database import db, create_document, get_documents
-from schemas import Contactmessage, Blogpost, Userauth, Pricingplan
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Oil SaaS API", version="1.0.0")
+# CPUs this process may run on; honours affinity like `nproc` in start_server.sh
+_CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+# Worker processes serving the app. start_server.sh exports WEB_CONCURRENCY to gunicorn
+# and the __main__ block sets it for uvicorn, so every worker sees the real count.
+_WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY")
+_WORKERS = int(_WEB_CONCURRENCY or 2 * _CPU_COUNT + 1)
+
+app = FastAPI(title="Oil SaaS API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Comma-separated list of allowed frontend origins, parsed once at import
+ALLOWED_ORIGINS = frozenset(
+    origin.strip()
+    for origin in os.getenv("FRONTEND_ORIGIN", "https://app.example.com").split(",")
+    if origin.strip()
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-@app.get("/")
-def read_root():
-    return {"message": "Oil SaaS API running"}
+async def _create_unique_index(collection, key: str) -> bool:
+    # Data migration: these indexes are new, and older writes never enforced uniqueness.
+    # If existing documents collide the build fails with a duplicate-key error; log it
+    # instead of refusing to boot. Any other failure (auth, conflicting spec) is real.
+    try:
+        await collection.create_index(key, unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        logger.error(
+            "Could not create unique index on %s.%s because existing documents have "
+            "duplicate values; remove the duplicates and restart to build it: %s",
+            collection.name, key, e,
+        )
+        return False
+    return True
+
+# Signup relies on the userauth.email index to reject duplicates; until it exists,
+# fall back to looking the email up before inserting
+_email_index_ready = False
+
+@app.on_event("startup")
+async def startup():
+    global _email_index_ready
+    # Create the Motor client here so it binds to the server's event loop
+    db = connect_db()
+    connect_redis()
+    if db is not None:
+        # Fail fast at boot rather than on the first request
+        await db.command("ping")
+        # Unique indexes let inserts detect duplicates in a single round-trip
+        _email_index_ready = await _create_unique_index(db.userauth, "email")
+        await _create_unique_index(db.blogpost, "slug")
+        await _create_unique_index(db.pricingplan, "name")
+        # Fallback token lookups when Redis misses or isn't configured
+        await db.userauth.create_index("token")
+        # Serves the published blog feed newest-first straight from the index
+        await db.blogpost.create_index([("published", 1), ("published_at", -1)])
+
+@app.on_event("shutdown")
+async def shutdown():
+    close_db()
+    await close_redis()
+
+# Polled by load balancers, so answer with plain text and skip JSON encoding
+@app.get("/", response_class=PlainTextResponse)
+@app.get("/healthz", response_class=PlainTextResponse)
+async def read_root():
+    return "ok"
 
 # ----------------------
 # Auth (simple demo only)
 # ----------------------
 class SignUpRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     name: str
-    email: EmailStr
+    email: Email
     password: str
     company: Optional[str] = None
 
 class SignInRequest(BaseModel):
-    email: EmailStr
+    model_config = ConfigDict(extra="ignore")
+
+    email: Email
     password: str
 
 class AuthResponse(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     user_id: str
     name: str
-    email: EmailStr
+    email: Email
     company: Optional[str] = None
     token: str
 
-from hashlib import sha256
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+# Argon2id with OWASP-recommended parameters
+password_hasher = PasswordHasher(time_cost=2, memory_cost=46 * 1024, parallelism=1)
+
+# Each Argon2 call holds ~46 MiB while it runs, and signup/signin are unauthenticated.
+# Hash on a dedicated pool instead of the default executor (up to 32 threads) so bursts
+# queue rather than pin gigabytes of RAM. When WEB_CONCURRENCY says how many workers share
+# the host, each gets its share of the cores (at least one thread); a lone process gets them all.
+_HASH_THREADS = max(1, _CPU_COUNT // _WORKERS) if _WEB_CONCURRENCY else _CPU_COUNT
+_hash_executor = ThreadPoolExecutor(max_workers=_HASH_THREADS, thread_name_prefix="argon2")
+
+async def hash_password(pw: str) -> str:
+    # Argon2 is CPU-bound; run it off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, password_hasher.hash, pw)
+
+async def verify_password(password_hash: str, pw: str) -> bool:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_hash_executor, password_hasher.verify, password_hash, pw)
+    except InvalidHashError:
+        # Accounts created before the Argon2 switch store an unsalted SHA-256 digest;
+        # compare in constant time so the check doesn't leak a timing side-channel
+        return hmac.compare_digest(password_hash, sha256(pw.encode()).hexdigest())
+    except VerificationError:
+        return False
+
+def needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith("$argon2") or password_hasher.check_needs_rehash(password_hash)
+
+def new_token() -> str:
+    return secrets.token_urlsafe(24)
+
+def hash_token(token: str) -> str:
+    # Tokens are random and high-entropy, so a fast hash is enough to keep them out of dumps
+    return sha256(token.encode()).hexdigest()
+
+TOKEN_TTL_SECONDS = 24 * 60 * 60
+
+def token_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=TOKEN_TTL_SECONDS)
+
+# Redis is only a cache in front of userauth.token, so its failures are logged and
+# skipped; Mongo stays the source of truth and get_current_user falls back to it.
+async def remember_token(token_hash: str, user_id: str, ttl: int = TOKEN_TTL_SECONDS):
+    if database.redis_client is None:
+        return
+    try:
+        await database.redis_client.setex(f"token:{token_hash}", ttl, user_id)
+    except RedisError:
+        logger.warning("Could not cache auth token in Redis", exc_info=True)
+
+async def forget_token(token_hash: str):
+    if database.redis_client is None:
+        return
+    try:
+        await database.redis_client.delete(f"token:{token_hash}")
+    except RedisError:
+        logger.warning("Could not evict auth token from Redis", exc_info=True)
+
+async def cached_user_id(token_hash: str) -> Optional[str]:
+    if database.redis_client is None:
+        return None
+    try:
+        return await database.redis_client.get(f"token:{token_hash}")
+    except RedisError:
+        logger.warning("Could not read auth token from Redis", exc_info=True)
+        return None
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> str:
+    """Resolve a bearer token to a user id, from Redis first and Mongo on a miss"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    token_hash = hash_token(credentials.credentials)
 
-def hash_password(pw: str) -> str:
-    return sha256(pw.encode()).hexdigest()
+    user_id = await cached_user_id(token_hash)
+    if user_id is not None:
+        return user_id
+
+    now = datetime.now(timezone.utc)
+    users = await get_documents(
+        "userauth", {"token": token_hash, "token_expires_at": {"$gt": now}}, 1,
+        projection={"_id": 1, "token_expires_at": 1},
+    )
+    if not users:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    user_id = str(users[0]["_id"])
+    # Cache only for the token's remaining lifetime so Redis never outlives Mongo's expiry
+    remaining = int((users[0]["token_expires_at"] - now).total_seconds())
+    if remaining > 0:
+        await remember_token(token_hash, user_id, remaining)
+    return user_id
 
 @app.post("/api/auth/signup", response_model=AuthResponse)
-def signup(payload: SignUpRequest):
-    existing = get_documents("userauth", {"email": payload.email})
-    if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
+async def signup(payload: SignUpRequest):
+    if not _email_index_ready:
+        existing = await get_documents("userauth", {"email": payload.email}, 1, projection={"_id": 1})
+        if existing:
+            raise HTTPException(status_code=400, detail="Email already registered")
 
+    token = new_token()
     user = Userauth(
         name=payload.name,
         email=payload.email,
-        password_hash=hash_password(payload.password),
+        password_hash=await hash_password(payload.password),
         company=payload.company or None,
+        token=hash_token(token),
+        token_expires_at=token_expiry(),
     )
-    new_id = create_document("userauth", user)
+    try:
+        new_id = await create_document("userauth", user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
 
+    await remember_token(user.token, new_id)
     return AuthResponse(
         user_id=new_id,
         name=user.name,
         email=user.email,
         company=user.company,
-        token=hash_password(user.email + new_id)[:32]
+        token=token
     )
 
 @app.post("/api/auth/signin", response_model=AuthResponse)
-def signin(payload: SignInRequest):
-    users = get_documents("userauth", {"email": payload.email})
+async def signin(payload: SignInRequest):
+    users = await get_documents("userauth", {"email": payload.email})
     if not users:
         raise HTTPException(status_code=404, detail="User not found")
     user = users[0]
-    if user.get("password_hash") != hash_password(payload.password):
+    if not await verify_password(user.get("password_hash", ""), payload.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = hash_password(user["email"] + str(user["_id"]))[:32]
+    token = new_token()
+    update = {"token": hash_token(token), "token_expires_at": token_expiry()}
+    if needs_rehash(user["password_hash"]):
+        # Upgrade legacy or outdated hashes while we have the plaintext
+        update["password_hash"] = await hash_password(payload.password)
+    await update_document("userauth", {"_id": user["_id"]}, update)
+    if user.get("token"):
+        await forget_token(user["token"])
+    await remember_token(update["token"], str(user["_id"]))
     return AuthResponse(
         user_id=str(user["_id"]),
         name=user.get("name"),
@@ -88,10 +283,16 @@ def signin(payload: SignInRequest):
         token=token
     )
 
+@app.get("/api/auth/me")
+async def current_user(user_id: str = Depends(get_current_user)):
+    return {"user_id": user_id}
+
 # --------------
 # Blog endpoints
 # --------------
 class BlogCreate(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     title: str
     excerpt: Optional[str] = None
     content: str
@@ -99,9 +300,18 @@ class BlogCreate(BaseModel):
     tags: List[str] = []
     cover_image: Optional[str] = None
 
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+def slugify(title: str) -> str:
+    # Fold accents to ASCII ("Café" -> "cafe"); scripts with no ASCII form, such as
+    # Cyrillic or CJK, drop out entirely and get a generated slug instead
+    ascii_title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii")
+    slug = _SLUG_RE.sub("-", ascii_title.lower()).strip("-")
+    return slug or f"post-{secrets.token_hex(4)}"
+
 @app.post("/api/blog", response_model=dict)
-def create_blog(post: BlogCreate):
-    slug = post.title.lower().replace(" ", "-")
+async def create_blog(post: BlogCreate):
+    slug = slugify(post.title)
     blog = Blogpost(
         title=post.title,
         slug=slug,
@@ -111,31 +321,53 @@ def create_blog(post: BlogCreate):
         tags=post.tags,
         cover_image=post.cover_image,
         published=True,
-        published_at=datetime.utcnow()
+        published_at=datetime.now(timezone.utc)
     )
-    new_id = create_document("blogpost", blog)
+    try:
+        new_id = await create_document("blogpost", blog)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="A post with this slug already exists")
     return {"id": new_id, "slug": slug}
 
-@app.get("/api/blog", response_model=List[dict])
-def list_blogs(limit: int = 10):
-    posts = get_documents("blogpost", {"published": True}, limit)
-    # Serialize ObjectId
-    for p in posts:
-        p["id"] = str(p.pop("_id", ""))
-    return posts
+class BlogSummary(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    id: str
+    title: str
+    slug: str
+    excerpt: Optional[str] = None
+    author: str
+    tags: List[str] = []
+    cover_image: Optional[str] = None
+    published_at: Optional[datetime] = None
+
+# List cards don't render the post body, so leave it out of the query
+BLOG_LIST_PROJECTION = {
+    "_id": 1, "title": 1, "slug": 1, "excerpt": 1, "author": 1,
+    "tags": 1, "cover_image": 1, "published_at": 1,
+}
+
+# responses= documents the shape without re-validating every post on the way out
+@app.get("/api/blog", responses={200: {"model": List[BlogSummary]}})
+async def list_blogs(limit: int = Query(10, ge=1, le=100), skip: int = Query(0, ge=0)):
+    posts = await get_documents("blogpost", {"published": True}, limit,
+                                projection=BLOG_LIST_PROJECTION, sort=[("published_at", -1)], skip=skip)
+    return serialize_ids(posts)
 
 # -----------------
 # Contact endpoint
 # -----------------
 class ContactRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     name: str
-    email: EmailStr
+    email: Email
     company: Optional[str] = None
     subject: Optional[str] = None
     message: str
 
 @app.post("/api/contact", response_model=dict)
-def submit_contact(payload: ContactRequest):
+async def submit_contact(payload: ContactRequest):
     doc = Contactmessage(
         name=payload.name,
         email=payload.email,
@@ -144,45 +376,82 @@ def submit_contact(payload: ContactRequest):
         message=payload.message,
         status="new"
     )
-    doc_id = create_document("contactmessage", doc)
+    doc_id = await create_document("contactmessage", doc)
     return {"status": "ok", "id": doc_id}
 
 # -----------------
 # Pricing endpoint
 # -----------------
-@app.get("/api/pricing", response_model=List[dict])
-def get_pricing():
-    # seed default plans if empty
-    count = db.pricingplan.count_documents({}) if db else 0
-    if count == 0 and db:
-        plans = [
-            Pricingplan(name="Starter", price_monthly=49, price_yearly=490, features=[
-                "Up to 1,000 barrels tracked",
-                "Basic analytics",
-                "Email support"
-            ], most_popular=False),
-            Pricingplan(name="Pro", price_monthly=199, price_yearly=1990, features=[
-                "Up to 25,000 barrels tracked",
-                "Advanced analytics",
-                "API access",
-                "Priority support"
-            ], most_popular=True),
-            Pricingplan(name="Enterprise", price_monthly=0, price_yearly=0, features=[
-                "Unlimited scale",
-                "Custom SLAs",
-                "Dedicated onboarding",
-                "SAML SSO"
-            ], most_popular=False),
-        ]
-        for pl in plans:
-            create_document("pricingplan", pl)
-    docs = get_documents("pricingplan", {})
-    for d in docs:
-        d["id"] = str(d.pop("_id", ""))
+DEFAULT_PRICING_PLANS = [
+    Pricingplan(name="Starter", price_monthly=49, price_yearly=490, features=[
+        "Up to 1,000 barrels tracked",
+        "Basic analytics",
+        "Email support"
+    ], most_popular=False),
+    Pricingplan(name="Pro", price_monthly=199, price_yearly=1990, features=[
+        "Up to 25,000 barrels tracked",
+        "Advanced analytics",
+        "API access",
+        "Priority support"
+    ], most_popular=True),
+    Pricingplan(name="Enterprise", price_monthly=0, price_yearly=0, features=[
+        "Unlimited scale",
+        "Custom SLAs",
+        "Dedicated onboarding",
+        "SAML SSO"
+    ], most_popular=False),
+]
+
+async def _seed_pricing():
+    # seed default plans if empty; runs once at startup instead of per request
+    db = database.db
+    if db is None:
+        return
+    if await db.pricingplan.count_documents({}) == 0:
+        try:
+            await create_documents("pricingplan", DEFAULT_PRICING_PLANS)
+        except BulkWriteError as e:
+            # another worker seeded concurrently; the unique name index kept it to one copy.
+            # Anything other than those duplicate-key errors is a real failure.
+            write_errors = e.details.get("writeErrors", [])
+            only_duplicates = write_errors and all(err.get("code") == 11000 for err in write_errors)
+            if not only_duplicates or e.details.get("writeConcernErrors"):
+                raise
+
+app.add_event_handler("startup", _seed_pricing)
+
+class PricingplanOut(Pricingplan):
+    model_config = ConfigDict(frozen=True)
+
+    id: str
+
+# Plans rarely change, so serve them from memory for a few minutes
+_pricing_cache = TTLCache(maxsize=1, ttl=300)
+
+@app.get("/api/pricing", responses={200: {"model": List[PricingplanOut]}})
+async def get_pricing():
+    try:
+        return _pricing_cache["plans"]
+    except KeyError:
+        pass
+
+    docs = serialize_ids(await get_documents("pricingplan", {}))
+    _pricing_cache["plans"] = docs
     return docs
 
+# Env vars don't change at runtime, and the collection probe is an admin round-trip,
+# so report both from memory and re-probe Mongo at most every 30 seconds
+_DATABASE_URL_STATUS = "✅ Set" if database.database_url else "❌ Not Set"
+_DATABASE_NAME_STATUS = "✅ Set" if database.database_name else "❌ Not Set"
+_test_cache = TTLCache(maxsize=1, ttl=30)
+
 @app.get("/test")
-def test_database():
+async def test_database():
+    try:
+        return _test_cache["response"]
+    except KeyError:
+        pass
+
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -191,6 +460,7 @@ def test_database():
         "connection_status": "Not Connected",
         "collections": []
     }
+    db = database.db
     try:
         if db is not None:
             response["database"] = "✅ Available"
@@ -198,7 +468,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -208,11 +478,15 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = _DATABASE_URL_STATUS
+    response["database_name"] = _DATABASE_NAME_STATUS
+    _test_cache["response"] = response
     return response
 
 if __name__ == "__main__":
+    # Production runs under gunicorn (see start_server.sh); this is the multi-worker fallback
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Worker processes inherit the environment, so they size their pools from this count
+    os.environ["WEB_CONCURRENCY"] = str(_WORKERS)
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=_WORKERS)
@@ -11,9 +11,22 @@ Model name is converted to lowercase for the collection name:
 - BlogPost -> "blogs" collection
 """
 
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
-from datetime import datetime
+import re
+from pydantic import AfterValidator, AwareDatetime, BaseModel, ConfigDict, Field
+from typing import Annotated, Optional, List
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def _validate_email(value: str) -> str:
+    # Lightweight shape check instead of full RFC validation via email-validator
+    value = value.strip()
+    if not _EMAIL_RE.match(value):
+        raise ValueError("value is not a valid email address")
+    # Domains are case-insensitive; lowercase them like EmailStr did
+    local, _, domain = value.rpartition("@")
+    return f"{local}@{domain.lower()}"
+
+Email = Annotated[str, AfterValidator(_validate_email)]
 
 # Example schemas (kept for reference):
 
@@ -48,17 +61,23 @@ class Userauth(BaseModel):
     Auth users collection
     Collection: "userauth"
     """
+    model_config = ConfigDict(extra="ignore")
+
     name: str
-    email: EmailStr
+    email: Email
     password_hash: str
     company: Optional[str] = None
     role: str = "user"
+    token: Optional[str] = None  # sha256 of the bearer token, never the token itself
+    token_expires_at: Optional[AwareDatetime] = None
 
 class Blogpost(BaseModel):
     """
     Blog posts collection
     Collection: "blogpost"
     """
+    model_config = ConfigDict(extra="ignore")
+
     title: str
     slug: str
     excerpt: Optional[str] = None
@@ -66,7 +85,7 @@ class Blogpost(BaseModel):
     author: str
     tags: List[str] = []
     published: bool = True
-    published_at: Optional[datetime] = None
+    published_at: Optional[AwareDatetime] = None  # stored as UTC
     cover_image: Optional[str] = None
 
 class Contactmessage(BaseModel):
@@ -74,8 +93,10 @@ class Contactmessage(BaseModel):
     Contact form submissions
     Collection: "contactmessage"
     """
+    model_config = ConfigDict(extra="ignore")
+
     name: str
-    email: EmailStr
+    email: Email
     company: Optional[str] = None
     message: str
     subject: Optional[str] = None
@@ -86,6 +107,8 @@ class Pricingplan(BaseModel):
     Pricing plans
     Collection: "pricingplan"
     """
+    model_config = ConfigDict(extra="ignore")
+
     name: str
     price_monthly: float
     price_yearly: float